@@ -1,35 +1,220 @@
+import hashlib
+import os
+import weakref
+from collections import OrderedDict
+
+import numpy as np
 import pandas as pd
-from collections import defaultdict
-from typing import Dict, Set
-from typing import List, Tuple
+import scipy.sparse as sp
+from typing import Dict, List, Optional, Set, Tuple
+
+try:
+    from numba import get_num_threads, njit, prange  # type: ignore
+except Exception:
+    njit = None
+    prange = range
+
+def _as_int32(ids: pd.Series) -> pd.Series:
+    """Downcast an integer id column to int32 when every value fits (Elliptic txIds do)."""
+    if len(ids) == 0 or not pd.api.types.is_integer_dtype(ids.dtype):
+        return ids
+    info = np.iinfo(np.int32)
+    if ids.min() < info.min or ids.max() > info.max:
+        return ids
+    return ids.astype(np.int32, copy=False)
+
+
+def _as_int32_edges(edges: pd.DataFrame) -> pd.DataFrame:
+    return pd.DataFrame({"txId1": _as_int32(edges["txId1"]), "txId2": _as_int32(edges["txId2"])})
+
 
 #The add_fan_in_out function computes transaction-level graph degree features 
 # by counting how many upstream and downstream transactions are directly connected to each transaction, 
 # capturing aggregation and distribution behavior relevant to Bitcoin AML typologies.
 
 def add_fan_in_out(df: pd.DataFrame, edges: pd.DataFrame) -> pd.DataFrame:
-    out_deg = edges["txId1"].value_counts().rename("fan_out_1hop")
-    in_deg  = edges["txId2"].value_counts().rename("fan_in_1hop")
+    edges = _as_int32_edges(edges)
+    out_deg = edges.groupby("txId1", sort=False).size()
+    in_deg  = edges.groupby("txId2", sort=False).size()
+
+    out = df.copy(deep=False)
+    out["txId"] = _as_int32(out["txId"])
+    txids = out["txId"].to_numpy()
+    out["fan_out_1hop"] = out_deg.reindex(txids, fill_value=0).to_numpy(dtype=np.int32)
+    out["fan_in_1hop"]  = in_deg.reindex(txids, fill_value=0).to_numpy(dtype=np.int32)
+    return out
 
-    out = df.copy()
-    out = out.merge(out_deg, left_on="txId", right_index=True, how="left")
-    out = out.merge(in_deg,  left_on="txId", right_index=True, how="left")
 
-    out["fan_out_1hop"] = out["fan_out_1hop"].fillna(0).astype(int)
-    out["fan_in_1hop"]  = out["fan_in_1hop"].fillna(0).astype(int)
+#_build_undirected_csr() constructs an undirected transaction graph in compressed sparse row (CSR) form:
+# txIds are factorized to dense ids 0..N-1 in ascending txId order (id_map[i] is the txId of node i, so
+# id_map is sorted and dense-id order equals txId order) and the neighbors of node i
+# are indices[indptr[i]:indptr[i+1]], enabling proximity-based AML risk features such as illicit
+# neighborhood exposure and layering detection without one Python set per node.
+def _build_undirected_csr(edges: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    codes, uniques = pd.factorize(
+        _as_int32(pd.concat([edges["txId1"], edges["txId2"]], ignore_index=True)), sort=True
+    )
+    id_map = np.asarray(uniques)
+    n_nodes = len(id_map)
+    n_edges = len(edges)
+
+    a = codes[:n_edges].astype(np.int64)
+    b = codes[n_edges:].astype(np.int64)
+
+    # Both directions, encoded as one sortable key; np.unique sorts by (src, dst)
+    # and drops repeated edges in a single pass.
+    keys = np.unique(np.concatenate([a * n_nodes + b, b * n_nodes + a]))
+    src = (keys // n_nodes).astype(np.int32)
+    indices = (keys % n_nodes).astype(np.int32)
+
+    indptr = np.zeros(n_nodes + 1, dtype=np.int32)
+    np.cumsum(np.bincount(src, minlength=n_nodes), out=indptr[1:])
+    return indptr, indices, id_map
+
+
+def _segment_sum(values: np.ndarray, indptr: np.ndarray) -> np.ndarray:
+    """Sum values[indptr[i]:indptr[i+1]] for every CSR row i (empty rows sum to 0)."""
+    csum = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(values, out=csum[1:])
+    return csum[indptr[1:]] - csum[indptr[:-1]]
+
+
+def _safe_ratio(num: pd.Series, den: pd.Series) -> np.ndarray:
+    """num / den as float64, NaN where den == 0."""
+    num = num.to_numpy(dtype=np.float64)
+    den = den.to_numpy(dtype=np.float64)
+    ratio = np.full_like(num, np.nan)
+    np.divide(num, den, out=ratio, where=den > 0)
+    return ratio
+
+
+def _take_nodes(values: np.ndarray, node_ids: np.ndarray) -> np.ndarray:
+    """Gather per-node values for each row; rows with no node (node_ids == -1) get 0."""
+    out = np.zeros(len(node_ids), dtype=np.int64)
+    known = node_ids >= 0
+    out[known] = values[node_ids[known]]
     return out
 
 
-#_build_undirected_adj() constructs an undirected transaction graph where each transaction is mapped 
-# to its immediate neighbors, enabling proximity-based AML risk features such as illicit neighborhood 
-# exposure and layering detection.
-def _build_undirected_adj(edges: pd.DataFrame) -> Dict[int, Set[int]]: 
-    adj: Dict[int, Set[int]] = defaultdict(set)
-    for a, b in zip(edges["txId1"].values, edges["txId2"].values):
-        a = int(a); b = int(b)
-        adj[a].add(b)
-        adj[b].add(a)
-    return adj
+# Built adjacencies keyed by id(edges). The weakref guards against a recycled id after the
+# original edges frame is garbage collected; edges frames are treated as immutable once built.
+# Each entry also records the cache_dirs the adjacency is known to be persisted in.
+_CSR_CACHE: "OrderedDict[int, Tuple[weakref.ref, Tuple[np.ndarray, np.ndarray, np.ndarray], Set[str]]]" = OrderedDict()
+_CSR_CACHE_MAXSIZE = 4
+
+
+_CSR_ARRAYS = ("indptr", "indices", "id_map")
+
+
+def _edges_fingerprint(edges: pd.DataFrame) -> str:
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((edges.shape, str(edges["txId1"].dtype), str(edges["txId2"].dtype))).encode())
+    h.update(np.ascontiguousarray(edges["txId1"].to_numpy()).tobytes())
+    h.update(np.ascontiguousarray(edges["txId2"].to_numpy()).tobytes())
+    return h.hexdigest()
+
+
+#_load_or_build_csr() persists the CSR as one .npy file per array under cache_dir, named by a fingerprint
+# of the edge list, and memory-maps them on later runs (read-only) so a restart skips the rebuild and the
+# OS only pages in the parts of the graph that are actually traversed.
+# An already-built csr can be passed in to persist it without rebuilding.
+def _load_or_build_csr(
+    edges: pd.DataFrame,
+    cache_dir: str,
+    csr: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    prefix = os.path.join(cache_dir, f"adj_{_edges_fingerprint(edges)}")
+    paths = [f"{prefix}_{name}.npy" for name in _CSR_ARRAYS]
+    if all(os.path.exists(path) for path in paths):
+        if csr is not None:
+            return csr
+        indptr, indices, id_map = (np.load(path, mmap_mode="r") for path in paths)
+        return indptr, indices, id_map
+
+    if csr is None:
+        csr = _build_undirected_csr(edges)
+    os.makedirs(cache_dir, exist_ok=True)
+    for path, arr in zip(paths, csr):
+        tmp = f"{path}.tmp.npy"
+        np.save(tmp, arr)
+        os.replace(tmp, path)
+    return csr
+
+
+def build_undirected_csr(
+    edges: pd.DataFrame,
+    cache_dir: Optional[str] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns the (indptr, indices, id_map) CSR adjacency for an edges frame, building it
+    at most once per frame. Build it once and pass it to get_top_illicit_neighbors_for_tx
+    when inspecting many alerts against the same edges.
+    With cache_dir set, the arrays are also persisted there and memory-mapped on later runs.
+    """
+    key = id(edges)
+    hit = _CSR_CACHE.get(key)
+    if hit is not None and hit[0]() is edges:
+        _CSR_CACHE.move_to_end(key)
+        _, csr, persisted = hit
+        if cache_dir is not None and cache_dir not in persisted:
+            _load_or_build_csr(edges, cache_dir, csr=csr)
+            persisted.add(cache_dir)
+        return csr
+
+    persisted = set()
+    if cache_dir is not None:
+        csr = _load_or_build_csr(edges, cache_dir)
+        persisted.add(cache_dir)
+    else:
+        csr = _build_undirected_csr(edges)
+    _CSR_CACHE[key] = (weakref.ref(edges), csr, persisted)
+    while len(_CSR_CACHE) > _CSR_CACHE_MAXSIZE:
+        _CSR_CACHE.popitem(last=False)
+    return csr
+
+
+#_two_hop_counts_kernel() is the alternative to the A @ A strict 2-hop computation for graphs whose
+# squared adjacency would not fit in memory: it walks the CSR twice per node and dedups with an integer
+# stamp buffer (one per chunk of nodes) instead of a set. stamp[v] == near marks self + 1-hop of the
+# current node, stamp[v] == seen marks a 2-hop node already counted; stale stamps are always smaller.
+def _two_hop_counts_kernel(indptr, indices, is_illicit, n_chunks):
+    n = indptr.shape[0] - 1
+    nbr_count = np.zeros(n, dtype=np.int64)
+    illicit_count = np.zeros(n, dtype=np.int64)
+    chunk = (n + n_chunks - 1) // n_chunks
+
+    for c in prange(n_chunks):
+        stamp = np.zeros(n, dtype=np.int64)
+        lo = c * chunk
+        hi = min(n, lo + chunk)
+        for u in range(lo, hi):
+            near = 2 * (u - lo) + 1
+            seen = near + 1
+
+            stamp[u] = near
+            for j in range(indptr[u], indptr[u + 1]):
+                stamp[indices[j]] = near
+
+            cnt = 0
+            ill = 0
+            for j in range(indptr[u], indptr[u + 1]):
+                n1 = indices[j]
+                for m in range(indptr[n1], indptr[n1 + 1]):
+                    w = indices[m]
+                    if stamp[w] != near and stamp[w] != seen:
+                        stamp[w] = seen
+                        cnt += 1
+                        ill += is_illicit[w]
+
+            nbr_count[u] = cnt
+            illicit_count[u] = ill
+
+    return nbr_count, illicit_count
+
+
+_two_hop_counts_numba = (
+    njit(parallel=True)(_two_hop_counts_kernel) if njit is not None else None
+)
 
 
 # add_illicit_exposure() computes graph-based AML exposure features that quantify 
@@ -42,89 +227,139 @@ def add_illicit_exposure(
     class_col: str = "class_name",
     txid_col: str = "txId",
     compute_2hop: bool = True,
+    two_hop_method: str = "sparse",
+    csr_cache_dir: Optional[str] = None,
 ) -> pd.DataFrame:
-    out = df.copy()
+    """
+    csr_cache_dir: if set, the undirected adjacency is persisted/memory-mapped there
+      (see build_undirected_csr) so repeated sessions on the same edges skip the rebuild.
+    two_hop_method:
+      - "sparse": strict 2-hop via scipy A @ A (default)
+      - "numba": per-node CSR walk JIT-compiled with numba (optional dependency);
+        use when A @ A is too large for memory on very dense neighborhoods
+    """
+    if two_hop_method not in ("sparse", "numba"):
+        raise ValueError(f"two_hop_method must be 'sparse' or 'numba', got {two_hop_method!r}")
+    if compute_2hop and two_hop_method == "numba" and _two_hop_counts_numba is None:
+        raise ImportError("two_hop_method='numba' requires numba (pip install numba).")
+
+    out = df.copy(deep=False)
+    out[txid_col] = _as_int32(out[txid_col])
+    if not isinstance(out[class_col].dtype, pd.CategoricalDtype):
+        out[class_col] = out[class_col].astype("category")
 
     # Only "illicit" is illicit
-    illicit_set = set(out.loc[out[class_col] == "illicit", txid_col].astype(int).values)
+    illicit_ids = out.loc[out[class_col] == "illicit", txid_col].to_numpy()
 
-    adj = _build_undirected_adj(edges)
-    txids = out[txid_col].astype(int).values
+    txids = out[txid_col].to_numpy()
 
-    nbr_count_1 = []
-    illicit_count_1 = []
+    indptr, indices, id_map = build_undirected_csr(edges, cache_dir=csr_cache_dir)
+    n_nodes = len(id_map)
+    id_index = pd.Index(id_map)
+    node_ids = id_index.get_indexer(txids)
 
-    for t in txids:
-        nbrs = adj.get(int(t), set())
-        nbr_count_1.append(len(nbrs))
-        illicit_count_1.append(sum((n in illicit_set) for n in nbrs))
+    # Dense illicit lookup over CSR node ids
+    illicit_nodes = id_index.get_indexer(illicit_ids)
+    is_illicit = np.zeros(n_nodes, dtype=np.int8)
+    is_illicit[illicit_nodes[illicit_nodes >= 0]] = 1
 
-    out["nbr_count_1hop"] = nbr_count_1
-    out["illicit_nbr_count_1hop"] = illicit_count_1
+    # 1-hop: degree is the CSR row length; illicit count is a segment sum over each row
+    out["nbr_count_1hop"] = _take_nodes(np.diff(indptr), node_ids)
+    out["illicit_nbr_count_1hop"] = _take_nodes(_segment_sum(is_illicit[indices], indptr), node_ids)
 
     # IMPORTANT: keep NaN when denom=0 (not computable != 0 exposure)
-    out["illicit_nbr_ratio_1hop"] = (
-        out["illicit_nbr_count_1hop"] / out["nbr_count_1hop"].replace(0, pd.NA)
-    ).astype("float")
+    out["illicit_nbr_ratio_1hop"] = _safe_ratio(out["illicit_nbr_count_1hop"], out["nbr_count_1hop"])
 
     if not compute_2hop:
         return out
 
-    nbr_count_2 = []
-    illicit_count_2 = []
-
-    for t in txids:
-        t = int(t)
-        nbrs1 = adj.get(t, set())
-        nbrs2 = set()
-        for n1 in nbrs1:
-            nbrs2.update(adj.get(n1, set()))
+    if two_hop_method == "numba":
+        nbr_count_2, illicit_count_2 = _two_hop_counts_numba(
+            indptr, indices, is_illicit, max(1, get_num_threads())
+        )
+        out["nbr_count_2hop_strict"] = _take_nodes(nbr_count_2, node_ids)
+        out["illicit_nbr_count_2hop_strict"] = _take_nodes(illicit_count_2, node_ids)
+    else:
+        # A @ A counts walks of length 2; its support is every node reachable in two steps.
+        A = sp.csr_matrix(
+            (np.ones(len(indices), dtype=np.int32), indices, indptr), shape=(n_nodes, n_nodes)
+        )
+        A2 = (A @ A).tocsr()
 
         # strict 2-hop: exclude self + direct neighbors
-        nbrs2.discard(t)
-        nbrs2.difference_update(nbrs1)
+        reach1 = (A + sp.identity(n_nodes, dtype=np.int32, format="csr")) != 0
+        A2 = (A2 - A2.multiply(reach1)).tocsr()
+        A2.eliminate_zeros()
+        A2.data[:] = 1
 
-        nbr_count_2.append(len(nbrs2))
-        illicit_count_2.append(sum((n in illicit_set) for n in nbrs2))
-
-    out["nbr_count_2hop_strict"] = nbr_count_2
-    out["illicit_nbr_count_2hop_strict"] = illicit_count_2
+        out["nbr_count_2hop_strict"] = _take_nodes(np.diff(A2.indptr), node_ids)
+        out["illicit_nbr_count_2hop_strict"] = _take_nodes(A2 @ is_illicit, node_ids)
 
     # IMPORTANT: keep NaN when denom=0 (not computable != 0 exposure)
-    out["illicit_nbr_ratio_2hop_strict"] = (
-        out["illicit_nbr_count_2hop_strict"] / out["nbr_count_2hop_strict"].replace(0, pd.NA)
-    ).astype("float")
+    out["illicit_nbr_ratio_2hop_strict"] = _safe_ratio(
+        out["illicit_nbr_count_2hop_strict"], out["nbr_count_2hop_strict"]
+    )
 
     return out
 
 
+def _smallest_k(node_ids: np.ndarray, k: int) -> np.ndarray:
+    """The k smallest node ids, sorted (partition first, then sort only those k)."""
+    if k <= 0 or len(node_ids) == 0:
+        return node_ids[:0]
+    if len(node_ids) > k:
+        node_ids = np.partition(node_ids, k - 1)[:k]
+    return np.sort(node_ids)
+
+
 def get_top_illicit_neighbors_for_tx(
     txid: int,
     edges: pd.DataFrame,
     illicit_set: set,
     k: int = 5,
+    adj: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None,
+    is_illicit: Optional[np.ndarray] = None,
 ) -> Dict[str, List[int]]:
     """
     Returns top illicit neighbor IDs for:
       - 1-hop undirected neighbors
       - strict 2-hop undirected neighbors (exclude self and 1-hop)
     Note: "top" is currently by presence only (IDs), since Elliptic edges are unweighted.
+    When looping over many alerts, build adj=build_undirected_csr(edges) and
+    is_illicit=build_illicit_lookup(adj, illicit_set) once and pass both.
     """
-    adj = _build_undirected_adj(edges)
+    if adj is None:
+        adj = build_undirected_csr(edges)
+    indptr, indices, id_map = adj
+
+    def illicit_only(nodes: np.ndarray) -> np.ndarray:
+        if is_illicit is not None:
+            return nodes[is_illicit[nodes].astype(bool)]
+        flags = np.fromiter(
+            (t in illicit_set for t in id_map[nodes].tolist()), dtype=bool, count=len(nodes)
+        )
+        return nodes[flags]
 
     txid = int(txid)
-    nbrs1 = adj.get(txid, set())
-
-    illicit_1hop = sorted([n for n in nbrs1 if n in illicit_set])[:k]
-
-    # strict 2-hop
-    nbrs2 = set()
-    for n1 in nbrs1:
-        nbrs2.update(adj.get(n1, set()))
-    nbrs2.discard(txid)
-    nbrs2.difference_update(nbrs1)
-
-    illicit_2hop = sorted([n for n in nbrs2 if n in illicit_set])[:k]
+    i = int(np.searchsorted(id_map, txid))
+    if i == len(id_map) or id_map[i] != txid:
+        return {
+            "top_illicit_neighbors_1hop": [],
+            "top_illicit_neighbors_2hop_strict": [],
+        }
+    nbrs1 = indices[indptr[i]:indptr[i + 1]]
+
+    # id_map is sorted, so the smallest node ids are the smallest txIds
+    illicit_1hop = id_map[_smallest_k(illicit_only(nbrs1), k)].tolist()
+
+    # strict 2-hop: exclude self + direct neighbors
+    if len(nbrs1) > 0:
+        cands = np.unique(np.concatenate([indices[indptr[n1]:indptr[n1 + 1]] for n1 in nbrs1]))
+    else:
+        cands = nbrs1
+    nbrs2 = np.setdiff1d(cands, np.union1d(nbrs1, [i]), assume_unique=True)
+
+    illicit_2hop = id_map[_smallest_k(illicit_only(nbrs2), k)].tolist()
 
     return {
         "top_illicit_neighbors_1hop": illicit_1hop,
@@ -135,3 +370,12 @@ def get_top_illicit_neighbors_for_tx(
 def build_illicit_set(df: pd.DataFrame, txid_col: str = "txId", class_col: str = "class_name") -> set:
     """Convenience helper: txIds labeled illicit in Elliptic."""
     return set(df.loc[df[class_col] == "illicit", txid_col].astype(int).values)
+
+
+def build_illicit_lookup(
+    adj: Tuple[np.ndarray, np.ndarray, np.ndarray],
+    illicit_set: set,
+) -> np.ndarray:
+    """Convenience helper: int8 is_illicit[node] over the node ids of a CSR adjacency."""
+    id_map = adj[2]
+    return np.isin(id_map, np.fromiter(illicit_set, dtype=np.int64, count=len(illicit_set))).astype(np.int8)
@@ -5,16 +5,28 @@ Usage:
     from src.llm.investigator import build_alert_payload, investigate_alert
     payload = build_alert_payload(row_dict)
     report = investigate_alert(payload, model="gpt-4o-mini")
+
+    # Batch of alerts, concurrently (use `await` directly inside Jupyter)
+    reports = asyncio.run(investigate_alerts(payloads, concurrency=16))
 """
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
+import json
 import os
-from typing import Any, Dict, List, Literal, Optional, Union
+import sqlite3
+import threading
+import weakref
+from contextlib import closing
+from typing import Any, Dict, List, Literal, Optional, Set, Union
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from pydantic import BaseModel, Field
 
+from src.risk.risk_scoring import decode_reasons
+
 try:
     from dotenv import load_dotenv  # type: ignore
 
@@ -180,7 +192,11 @@ def build_alert_payload(row: Dict[str, Any]) -> Dict[str, Any]:
         "time_step": _safe_int(row.get("time_step", -1), default=-1),
         "severity": str(row.get("severity", "low")),
         "risk_score": _safe_int(row.get("risk_score", 0), default=0),
-        "alert_reasons": row.get("alert_reasons", []),
+        "alert_reasons": (
+            decode_reasons(row["alert_reason_mask"], row)
+            if row.get("alert_reason_mask") is not None
+            else row.get("alert_reasons", [])
+        ),
         "fan_in_1hop": _safe_int(row.get("fan_in_1hop", 0), default=0),
         "fan_out_1hop": _safe_int(row.get("fan_out_1hop", 0), default=0),
         # Clear counts + totals (not "legitimate")
@@ -207,52 +223,224 @@ def build_alert_payload(row: Dict[str, Any]) -> Dict[str, Any]:
     return payload
 
 
-def investigate_alert(
-    payload: Dict[str, Any],
-    model: str = "gpt-4o-mini",
-    temperature: float = 0.0,
-) -> Dict[str, Any]:
+def _require_api_key() -> str:
     api_key = os.environ.get("OPENAI_API_KEY")
     if not api_key:
         raise RuntimeError(
             "OPENAI_API_KEY not found. Set it as an environment variable or in a .env file."
         )
-
-    client = OpenAI(api_key=api_key)
-
-    user_prompt = (
-        "Create an AML investigation summary for the following alert payload.\n"
-        "Rules:\n"
-        "- Use only the provided fields.\n"
-        "- Always use 'illicit-labeled' when describing nodes/neighbors (avoid 'illicit nodes').\n"
-        "- If total_neighbors_2hop_strict is very small (<=2), mention that 2-hop evidence is based on a limited strict 2-hop neighborhood size.\n"
-        "- In confidence_rationale, distinguish confidence in graph-label proximity vs confidence in real-world attribution (amounts/entities absent).\n"
-        "- If exposure ratios are high and counts are available, prefer including both 1-hop and strict 2-hop neighbor review actions.\n"
-        "- Do not infer addresses, entities, amounts, or attribution.\n"
-        "- When discussing labels, use 'labeled illicit' or 'illicit-labeled in the dataset'.\n"
-        "- Do NOT claim the transaction is illicit; describe risk signals and graph exposure only.\n"
-        "- If total_neighbors_* or illicit_neighbors_* is null/None, do NOT say 'all neighbors'; "
-        "instead state counts are unavailable.\n"
-        "- likely_typologies must be evidence-backed:\n"
-        "  * aggregation requires fan_in_1hop support\n"
-        "  * distribution requires fan_out_1hop support\n"
-        "  * layering requires elevated strict 2-hop exposure (and mention the exposure evidence)\n"
-        "  Otherwise include 'unknown'.\n"
-        "- Recommended next steps MUST be chosen from ACTION_LIBRARY "
-        "(you may lightly rephrase but do not invent new actions).\n"
-        "- In the 'evidence' array, use primitive values only (string/int/float/bool/null).\n\n"
-        f"ACTION_LIBRARY:\n{ACTION_LIBRARY}\n\n"
-        f"ALERT_PAYLOAD:\n{payload}"
+    return api_key
+
+
+# Static part of the user prompt (rules + ACTION_LIBRARY), rendered once at import.
+_STATIC_USER_PREFIX = (
+    "Create an AML investigation summary for the following alert payload.\n"
+    "Rules:\n"
+    "- Use only the provided fields.\n"
+    "- Always use 'illicit-labeled' when describing nodes/neighbors (avoid 'illicit nodes').\n"
+    "- If total_neighbors_2hop_strict is very small (<=2), mention that 2-hop evidence is based on a limited strict 2-hop neighborhood size.\n"
+    "- In confidence_rationale, distinguish confidence in graph-label proximity vs confidence in real-world attribution (amounts/entities absent).\n"
+    "- If exposure ratios are high and counts are available, prefer including both 1-hop and strict 2-hop neighbor review actions.\n"
+    "- Do not infer addresses, entities, amounts, or attribution.\n"
+    "- When discussing labels, use 'labeled illicit' or 'illicit-labeled in the dataset'.\n"
+    "- Do NOT claim the transaction is illicit; describe risk signals and graph exposure only.\n"
+    "- If total_neighbors_* or illicit_neighbors_* is null/None, do NOT say 'all neighbors'; "
+    "instead state counts are unavailable.\n"
+    "- likely_typologies must be evidence-backed:\n"
+    "  * aggregation requires fan_in_1hop support\n"
+    "  * distribution requires fan_out_1hop support\n"
+    "  * layering requires elevated strict 2-hop exposure (and mention the exposure evidence)\n"
+    "  Otherwise include 'unknown'.\n"
+    "- Recommended next steps MUST be chosen from ACTION_LIBRARY "
+    "(you may lightly rephrase but do not invent new actions).\n"
+    "- In the 'evidence' array, use primitive values only (string/int/float/bool/null).\n\n"
+    "ACTION_LIBRARY:\n"
+    + "\n".join(f"- {a}" for a in ACTION_LIBRARY)
+    + "\n\nALERT_PAYLOAD:\n"
+)
+
+
+def _build_user_prompt(payload: Dict[str, Any]) -> str:
+    return _STATIC_USER_PREFIX + json.dumps(payload, default=str)
+
+
+# Investigation reports are cached on disk keyed by a canonical hash of
+# (payload, model, temperature, prompts, report schema), so re-running the same alerts
+# skips the API and a schema change never serves reports in the old shape.
+LLM_CACHE_PATH = os.environ.get(
+    "LLM_CACHE_PATH", os.path.join(".llm_cache", "investigations.sqlite")
+)
+
+
+_REPORT_SCHEMA = InvestigationReport.model_json_schema()
+
+
+def _cache_key(payload: Dict[str, Any], model: str, temperature: float) -> str:
+    canonical = json.dumps(
+        {
+            "payload": payload,
+            "model": model,
+            "temperature": temperature,
+            "system_prompt": SYSTEM_PROMPT,
+            "user_prompt_template": _STATIC_USER_PREFIX,
+            "report_schema": _REPORT_SCHEMA,
+        },
+        sort_keys=True,
+        default=str,
     )
+    return hashlib.blake2b(canonical.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# Cache files whose directory and table already exist (setup runs once per path)
+_CACHE_READY: Set[str] = set()
+_CACHE_READY_LOCK = threading.Lock()
+
+
+def _cache_connect() -> sqlite3.Connection:
+    path = LLM_CACHE_PATH
+    with _CACHE_READY_LOCK:
+        if path not in _CACHE_READY:
+            cache_dir = os.path.dirname(path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            with closing(sqlite3.connect(path)) as conn, conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS reports (key TEXT PRIMARY KEY, report TEXT NOT NULL)"
+                )
+            _CACHE_READY.add(path)
+    return sqlite3.connect(path)
+
+
+def _cache_get(key: str) -> Optional[Dict[str, Any]]:
+    with closing(_cache_connect()) as conn:
+        row = conn.execute("SELECT report FROM reports WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row is not None else None
+
+
+def _cache_put(key: str, report: Dict[str, Any]) -> None:
+    with closing(_cache_connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO reports (key, report) VALUES (?, ?)",
+            (key, json.dumps(report)),
+        )
+
+
+def _messages(payload: Dict[str, Any]) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": _build_user_prompt(payload)},
+    ]
+
+
+_client: Optional[OpenAI] = None
+
+
+def _get_client() -> OpenAI:
+    """Lazily created module-level client, so connections are reused across alerts."""
+    global _client
+    if _client is None:
+        _client = OpenAI(api_key=_require_api_key())
+    return _client
+
+
+def investigate_alert(
+    payload: Dict[str, Any],
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.0,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    key = _cache_key(payload, model, temperature) if use_cache else None
+    if key is not None:
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached
+
+    client = _get_client()
 
     resp = client.responses.parse(
         model=model,
-        input=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": user_prompt},
-        ],
+        input=_messages(payload),
         text_format=InvestigationReport,
         temperature=temperature,
     )
 
-    return resp.output_parsed.model_dump()
+    report = resp.output_parsed.model_dump()
+    if key is not None:
+        _cache_put(key, report)
+    return report
+
+
+# One AsyncOpenAI client (and connection pool) per event loop; an async client
+# cannot be reused once the loop it was first used on has been closed.
+_ASYNC_CLIENTS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _get_async_client() -> AsyncOpenAI:
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.get(loop)
+    if client is None:
+        client = AsyncOpenAI(api_key=_require_api_key())
+        _ASYNC_CLIENTS[loop] = client
+    return client
+
+
+async def investigate_alert_async(
+    payload: Dict[str, Any],
+    sem: Optional[asyncio.Semaphore] = None,
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.0,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    """
+    Async variant of investigate_alert. Pass a shared semaphore to bound the number of
+    in-flight requests when running many of these concurrently.
+    """
+    key = _cache_key(payload, model, temperature) if use_cache else None
+    if key is not None:
+        cached = await asyncio.to_thread(_cache_get, key)
+        if cached is not None:
+            return cached
+
+    client = _get_async_client()
+    if sem is None:
+        sem = asyncio.Semaphore(1)
+
+    async with sem:
+        resp = await client.responses.parse(
+            model=model,
+            input=_messages(payload),
+            text_format=InvestigationReport,
+            temperature=temperature,
+        )
+
+    report = resp.output_parsed.model_dump()
+    if key is not None:
+        await asyncio.to_thread(_cache_put, key, report)
+    return report
+
+
+async def investigate_alerts(
+    payloads: List[Dict[str, Any]],
+    concurrency: int = 16,
+    model: str = "gpt-4o-mini",
+    temperature: float = 0.0,
+    use_cache: bool = True,
+) -> List[Union[Dict[str, Any], BaseException]]:
+    """
+    Investigates a batch of alert payloads concurrently (at most `concurrency` requests
+    in flight). Reports are returned in the same order as `payloads`; a request that
+    fails (rate limit, parse error, ...) leaves its exception in its position instead
+    of aborting the rest of the batch.
+    """
+    sem = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(
+        *[
+            investigate_alert_async(
+                p, sem, model=model, temperature=temperature, use_cache=use_cache
+            )
+            for p in payloads
+        ],
+        return_exceptions=True,
+    )
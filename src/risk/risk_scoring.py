@@ -1,9 +1,67 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Dict, List, Tuple, Optional
+from typing import Any, Dict, List, Mapping, Tuple, Optional
+import numpy as np
 import pandas as pd
 import math
+import warnings
+
+
+# Severity bands (tweakable; these are sensible defaults):
+# score < 3 low, 3-4 medium, 5-7 high, >= 8 critical
+SEVERITY_LABELS = np.array(["low", "medium", "high", "critical"], dtype=object)
+SEVERITY_BINS = np.array([3, 5, 8])
+
+
+# Alert reasons are stored per row as an int32 bitmask (alert_reason_mask); bit order is
+# the order reasons are listed in. Strings are only rendered on demand via decode_reasons().
+REASON_BITS: Dict[str, int] = {
+    code: 1 << i
+    for i, code in enumerate([
+        "exp1_not_computable",
+        "exp2_not_computable",
+        "exp1_extreme",
+        "exp1_elevated",
+        "exp2_extreme",
+        "exp2_elevated",
+        "fan_out_extreme",
+        "fan_out_high",
+        "fan_in_extreme",
+        "fan_in_high",
+    ])
+}
+
+REASON_TEXT: Dict[str, str] = {
+    "exp1_not_computable": "1-hop illicit exposure not computable (no labeled 1-hop neighbors or zero degree)",
+    "exp2_not_computable": "2-hop illicit exposure not computable (no labeled strict 2-hop neighbors or zero degree)",
+    "exp1_extreme": "Direct illicit exposure extremely high (1-hop ratio={exp1:.3f})",
+    "exp1_elevated": "Direct illicit exposure elevated (1-hop ratio={exp1:.3f})",
+    "exp2_extreme": "Indirect illicit exposure extremely high (2-hop ratio={exp2:.3f})",
+    "exp2_elevated": "Indirect illicit exposure elevated (2-hop ratio={exp2:.3f})",
+    "fan_out_extreme": "Extreme fan-out (out-degree={fan_out})",
+    "fan_out_high": "High fan-out (out-degree={fan_out})",
+    "fan_in_extreme": "Extreme fan-in (in-degree={fan_in})",
+    "fan_in_high": "High fan-in (in-degree={fan_in})",
+}
+
+
+def decode_reasons(mask: int, row: Mapping[str, Any]) -> List[str]:
+    """
+    Renders an alert_reason_mask into the human-readable reasons (same wording as
+    score_transaction), filling in the feature values from the scored row.
+    """
+    def _float(x: Any) -> float:
+        return float("nan") if x is None else float(x)
+
+    values = {
+        "exp1": _float(row.get("illicit_nbr_ratio_1hop")),
+        "exp2": _float(row.get("illicit_nbr_ratio_2hop_strict")),
+        "fan_out": int(row.get("fan_out_1hop", 0)),
+        "fan_in": int(row.get("fan_in_1hop", 0)),
+    }
+    mask = int(mask)
+    return [REASON_TEXT[code].format(**values) for code, bit in REASON_BITS.items() if mask & bit]
 
 
 @dataclass(frozen=True)
@@ -29,23 +87,31 @@ def fit_risk_config(
     Percentiles are robust for heavy-tailed graph features.
     """
     if use_known_only:
-        base = df_feat[df_feat[label_col].isin(["illicit", "licit"])].copy()
+        base = df_feat[df_feat[label_col].isin(["illicit", "licit"])]
     else:
-        base = df_feat.copy()
+        base = df_feat
+
+    cols = ["fan_out_1hop", "fan_in_1hop", "illicit_nbr_ratio_1hop", "illicit_nbr_ratio_2hop_strict"]
 
-    # Helper for safe quantiles
-    def q(col: str, p: float) -> float:
-        return float(base[col].quantile(p))
+    # One pass over all columns for both percentiles. NaN ratios ("not computable") are
+    # skipped like Series.quantile does; an all-NaN column yields NaN without warning.
+    values = base[cols].to_numpy(dtype=np.float64)
+    if len(values) == 0:
+        p95 = p99 = np.full(len(cols), np.nan)
+    else:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            p95, p99 = np.nanpercentile(values, [95, 99], axis=0)
 
     return RiskConfig(
-        fan_out_p99=q("fan_out_1hop", 0.99),
-        fan_out_p95=q("fan_out_1hop", 0.95),
-        fan_in_p99=q("fan_in_1hop", 0.99),
-        fan_in_p95=q("fan_in_1hop", 0.95),
-        exp1_p99=q("illicit_nbr_ratio_1hop", 0.99),
-        exp1_p95=q("illicit_nbr_ratio_1hop", 0.95),
-        exp2_p99=q("illicit_nbr_ratio_2hop_strict", 0.99),
-        exp2_p95=q("illicit_nbr_ratio_2hop_strict", 0.95),
+        fan_out_p99=float(p99[0]),
+        fan_out_p95=float(p95[0]),
+        fan_in_p99=float(p99[1]),
+        fan_in_p95=float(p95[1]),
+        exp1_p99=float(p99[2]),
+        exp1_p95=float(p95[2]),
+        exp2_p99=float(p99[3]),
+        exp2_p95=float(p95[3]),
     )
 
 
@@ -114,26 +180,64 @@ def add_risk_scores(
     """
     Adds:
       - risk_score (int)
-      - alert_reasons (list[str])
+      - alert_reason_mask (int32 bitmask over REASON_BITS; see decode_reasons)
       - severity (low/medium/high/critical)
+      - severity_rank (int8, 0=low .. 3=critical)
     """
-    out = df_feat.copy()
-
-    scored = out.apply(lambda r: score_transaction(r, cfg), axis=1)
-    out["risk_score"] = scored.apply(lambda x: x[0])
-    out["alert_reasons"] = scored.apply(lambda x: x[1])
-
-    # Severity bands (tweakable; these are sensible defaults)
-    def severity(score: int) -> str:
-        if score >= 8:
-            return "critical"
-        if score >= 5:
-            return "high"
-        if score >= 3:
-            return "medium"
-        return "low"
-
-    out["severity"] = out["risk_score"].apply(severity)
+    # Reasons from an earlier scoring pass (e.g. risk_rules) would not match this score
+    out = df_feat.drop(columns=["alert_reasons"], errors="ignore").copy(deep=False)
+    n = len(out)
+
+    def col(name: str, default: float) -> np.ndarray:
+        if name not in out.columns:
+            return np.full(n, default, dtype=np.float64)
+        return out[name].to_numpy(dtype=np.float64)
+
+    # Same rules as score_transaction(), evaluated on whole columns.
+    # Missing exposure columns are treated as NaN ("not computable"), matching row.get(...) -> None.
+    exp1 = col("illicit_nbr_ratio_1hop", np.nan)
+    exp2 = col("illicit_nbr_ratio_2hop_strict", np.nan)
+    fan_out = col("fan_out_1hop", 0).astype(np.int64)
+    fan_in = col("fan_in_1hop", 0).astype(np.int64)
+
+    exp1_nan = np.isnan(exp1)
+    exp2_nan = np.isnan(exp2)
+    exp1_extreme = (exp1 >= cfg.exp1_p99) & (exp1 > 0)
+    exp1_elevated = ~exp1_extreme & (exp1 >= cfg.exp1_p95) & (exp1 > 0)
+    exp2_extreme = (exp2 >= cfg.exp2_p99) & (exp2 > 0)
+    exp2_elevated = ~exp2_extreme & (exp2 >= cfg.exp2_p95) & (exp2 > 0)
+    fan_out_extreme = fan_out >= cfg.fan_out_p99
+    fan_out_high = ~fan_out_extreme & (fan_out >= cfg.fan_out_p95)
+    fan_in_extreme = fan_in >= cfg.fan_in_p99
+    fan_in_high = ~fan_in_extreme & (fan_in >= cfg.fan_in_p95)
+
+    out["risk_score"] = (
+        5 * exp1_extreme + 3 * exp1_elevated
+        + 3 * exp2_extreme + 2 * exp2_elevated
+        + 2 * fan_out_extreme + 1 * fan_out_high
+        + 2 * fan_in_extreme + 1 * fan_in_high
+    ).astype(np.int64)
+
+    reason_masks = {
+        "exp1_not_computable": exp1_nan,
+        "exp2_not_computable": exp2_nan,
+        "exp1_extreme": exp1_extreme,
+        "exp1_elevated": exp1_elevated,
+        "exp2_extreme": exp2_extreme,
+        "exp2_elevated": exp2_elevated,
+        "fan_out_extreme": fan_out_extreme,
+        "fan_out_high": fan_out_high,
+        "fan_in_extreme": fan_in_extreme,
+        "fan_in_high": fan_in_high,
+    }
+    reason_mask = np.zeros(n, dtype=np.int32)
+    for code, fired in reason_masks.items():
+        reason_mask |= fired.astype(np.int32) * np.int32(REASON_BITS[code])
+    out["alert_reason_mask"] = reason_mask
+
+    severity_rank = np.searchsorted(SEVERITY_BINS, out["risk_score"].to_numpy(), side="right")
+    out["severity"] = SEVERITY_LABELS[severity_rank]
+    out["severity_rank"] = severity_rank.astype(np.int8)
     return out
 
 
@@ -141,15 +245,25 @@ def get_alerts(
     df_scored: pd.DataFrame,
     min_severity: str = "medium",
     cols: Optional[List[str]] = None,
+    top_n: Optional[int] = None,
 ) -> pd.DataFrame:
     """
-    Filter alerts at or above min_severity.
+    Filter alerts at or above min_severity, highest risk_score first.
+    If top_n is given, only the top_n highest-scoring alerts are returned.
     """
     order = {"low": 0, "medium": 1, "high": 2, "critical": 3}
     cutoff = order[min_severity]
 
-    alerts = df_scored[df_scored["severity"].map(order) >= cutoff].copy()
-    alerts = alerts.sort_values(["risk_score"], ascending=False)
+    if "severity_rank" in df_scored.columns:
+        rank = df_scored["severity_rank"].to_numpy()
+    else:
+        rank = df_scored["severity"].map(order).to_numpy()
+    alerts = df_scored[rank >= cutoff]
+
+    if top_n is not None:
+        alerts = alerts.nlargest(top_n, "risk_score")
+    else:
+        alerts = alerts.sort_values(["risk_score"], ascending=False)
 
     if cols is None:
         cols = ["txId", "time_step", "class_name", "risk_score", "severity",
@@ -157,5 +271,13 @@ def get_alerts(
                 "nbr_count_1hop", "illicit_nbr_count_1hop",
                 "nbr_count_2hop_strict", "illicit_nbr_count_2hop_strict",
                 "illicit_nbr_ratio_1hop", "illicit_nbr_ratio_2hop_strict",
-                "alert_reasons"]
+                "alert_reason_mask", "alert_reasons"]
+
+    # Reason strings are rendered here, for the filtered alerts only
+    if "alert_reasons" in cols and "alert_reasons" not in alerts.columns:
+        value_cols = [c for c in ("illicit_nbr_ratio_1hop", "illicit_nbr_ratio_2hop_strict",
+                                  "fan_out_1hop", "fan_in_1hop") if c in alerts.columns]
+        rows = alerts[value_cols].to_dict("records")
+        reasons = [decode_reasons(m, r) for m, r in zip(alerts["alert_reason_mask"].to_numpy(), rows)]
+        alerts = alerts.assign(alert_reasons=pd.Series(reasons, index=alerts.index, dtype=object))
     return alerts[cols]